@@ -26,17 +26,28 @@ class PrettyPrintVisitor(object):
         self.include_attributes = include_attributes
         self.width = width
         self.indent = indent
+        # Bound visit-like methods found so far, keyed by class visited
+        self._visit_methods = {}
+        self._leaf_methods = {}
 
     def visit(self, node, depth=0, available=None):
         """Visit a node."""
-        method_name = 'visit_' + node.__class__.__name__
-        method = getattr(self, method_name, self.generic_visit_node)
+        cls = node.__class__
+        method = self._visit_methods.get(cls)
+        if method is None:
+            method_name = 'visit_' + cls.__name__
+            method = getattr(self, method_name, self.generic_visit_node)
+            self._visit_methods[cls] = method
         return method(node, depth, available or self.width)
 
     def leaf(self, value, depth, available):
         """Visit a leaf (non-node) value."""
-        method_name = 'leaf_' + value.__class__.__name__
-        method = getattr(self, method_name, self.generic_leaf)
+        cls = value.__class__
+        method = self._leaf_methods.get(cls)
+        if method is None:
+            method_name = 'leaf_' + cls.__name__
+            method = getattr(self, method_name, self.generic_leaf)
+            self._leaf_methods[cls] = method
         return method(value, depth, available)
 
     def generic_visit_value(self, value, depth, available):
@@ -281,7 +292,13 @@ class EmitJavaVisitor(PrettyPrintVisitor):
         """Called when a field is a str."""
         r = repr(value)
         if r[0]=="'":
-            r = '"' + r[1:-1].replace('"', '\\"').replace("\\'", "'") + '"'
+            # Switch to double quotes, replacing only if necessary
+            body = r[1:-1]
+            if '"' in body:
+                body = body.replace('"', '\\"')
+            if "\\'" in body:
+                body = body.replace("\\'", "'")
+            r = '"' + body + '"'
         return r, False
 
     _INT_MAX = 2**31-1
@@ -1,40 +1,84 @@
 # A parser for a file of Python code fragments intended as tests
 
 import re
+from collections import namedtuple
 
 
-class LineToken:
-    """A token representing one line from the examples file"""
-    def __init__(self, text):
-        self.text = text
-        self.arg = None
-        self._classify()
+# The kinds of line (LineToken.kind) found in an examples file
+EOF, CODE, HEAD, TEST = range(4)
+KIND_NAMES = ("EOF", "CODE", "HEAD", "TEST")
+
 
-    EOF = "EOF"
-    CODE = "CODE"
-    HEAD = "HEAD"
-    TEST = "TEST"
+class LineToken(namedtuple('LineToken', ['kind', 'arg', 'text'])):
+    """A token representing one line from the examples file"""
+    __slots__ = ()
 
     def __repr__(self):
-        return f"[{self.kind}, {self.arg}, {self.text!r}]"
-
-    HEAD_PATTERN = re.compile(r"#\s*(\w+):")
-    TEST_PATTERN = re.compile(r"#\s*\?\s*((\w+,?\s*)*)")
-
-    def _classify(self):
-        def as_tuple(names):
-            # Comma-separated names: split into a tuple discarding ''.
-            return tuple(n for n in map(str.strip, names.split(',')) if n)
-        if self.text is None:
-            self.kind = LineToken.EOF
-        elif m := self.HEAD_PATTERN.match(self.text):
-            self.kind = LineToken.HEAD
-            self.arg = m.group(1)
-        elif m := self.TEST_PATTERN.match(self.text):
-            self.kind = LineToken.TEST
-            self.arg = as_tuple(m.group(1))
-        else:
-            self.kind = LineToken.CODE
+        return f"[{KIND_NAMES[self.kind]}, {self.arg}, {self.text!r}]"
+
+
+# The one token that marks the end of the file
+EOF_TOKEN = LineToken(EOF, None, None)
+
+
+# The list of names on a TEST line (after the "?"), and one comma-separated
+# item within it (words separated only by spaces are a single item)
+_NAME_LIST = re.compile(r"\s*((?:\w+,?\s*)*)")
+_NAME_PATTERN = re.compile(r"\w+(?:\s+\w+)*")
+
+# The name on a HEAD line (before the ":")
+_HEAD_NAME = re.compile(r"\w+")
+
+
+def _code(text):
+    # Any line not otherwise recognised is code
+    return LineToken(CODE, None, text)
+
+
+def _test(text, rest):
+    # "# ? name, ..." names the variables a test checks (text after the
+    # list, such as a comment, is ignored)
+    names = _NAME_LIST.match(rest, 1).group(1)
+    return LineToken(TEST, tuple(_NAME_PATTERN.findall(names)), text)
+
+
+def _head(text, rest):
+    # "# name:" begins a test (other comments are code)
+    name, colon, _ = rest.partition(':')
+    if colon and _HEAD_NAME.fullmatch(name):
+        return LineToken(HEAD, name, text)
+    else:
+        return LineToken(CODE, None, text)
+
+
+def _marker(text):
+    # A line beginning "#": the next non-space character decides
+    rest = text[1:].lstrip()
+    return _MARKERS.get(rest[:1], _head)(text, rest)
+
+
+# Classifiers by first character of a line, or of a marker after "#"
+_LINES = {'#': _marker}
+_MARKERS = {'?': _test}
+
+
+def classify(text):
+    """Return a LineToken classifying one line (text None means EOF).
+
+    A HEAD line is "# name:" and a TEST line is "# ? name, ...". Lines are
+    classified by looking up their first character (and the first after
+    "#") in a table. Only the names on HEAD and TEST lines need a regular
+    expression.
+    """
+    if text is None:
+        return EOF_TOKEN
+    return _LINES.get(text[:1], _code)(text)
+
+
+def tokenize(text):
+    """Return a list of LineTokens classifying every line of the text."""
+    return [classify(line.rstrip()) for line in text.splitlines()]
+
 
 class Test:
     """A test derived by parsing the examples file."""
@@ -53,10 +97,16 @@ class Test:
 
 
 class Lines:
-    """A structure to hold and classify a line read from a stream."""
+    """A structure to hold and classify lines read from a stream."""
+
     def __init__(self, f):
-        self.f = f
-        self.line = LineToken(None)
+        # The examples files are small: read and classify them in one go.
+        self.tokens = tokenize(f.read())
+        # The text of each line, so that runs of code may be sliced out
+        self.texts = [t.text for t in self.tokens]
+        # self.line is always self.tokens[self.index] or an EOF token
+        self.index = -1
+        self.line = EOF_TOKEN
         self.consume()
 
     def __repr__(self):
@@ -66,62 +116,67 @@ class Lines:
         """Return the current line, and advance to and classify the next."""
         #print("    consume() =", repr(self.line))
         prev = self.line
-        if line := self.f.readline():
-            self.line = LineToken(line.rstrip())
+        self.index += 1
+        if self.index < len(self.tokens):
+            self.line = self.tokens[self.index]
         else:
-            self.line = LineToken(None)
+            self.line = EOF_TOKEN
         return prev
 
+    def consume_code(self):
+        """Consume consecutive CODE lines, returning their text as a list."""
+        tokens = self.tokens
+        i = j = self.index
+        n = len(tokens)
+        while j < n and tokens[j].kind == CODE:
+            j += 1
+        # Position at the last CODE line, then step beyond it
+        self.index = j - 1
+        self.consume()
+        return self.texts[i:j]
+
     def kind(self):
         return self.line.kind
 
-    def close(self):
-        self.f.close()
-
     def expect(self, kind):
         """Check that the current line is of the expected kind."""
-        if self.kind() != kind:
+        if self.line.kind != kind:
             raise SyntaxError("Expected: {} got {}".format(
-                kind, self.line))
+                KIND_NAMES[kind], self.line))
 
     def parse_preamble(self):
         """Ignore lines until positioned at the head of the first test."""
-        while self.kind() == LineToken.CODE:
-            self.consume()
+        self.consume_code()
 
     def parse_test(self):
         """Return the next Test object from the examples file."""
         name = self.parse_head()
         t = Test(name)
-        while self.kind() == LineToken.CODE:
-            t.cases.append(self.consume().text)
+        t.cases = self.consume_code()
         t.test = self.parse_query()
         t.body = self.parse_body()
         return t
 
     def parse_head(self):
         """Parse a HEAD line returning the test name."""
-        self.expect(LineToken.HEAD)
+        self.expect(HEAD)
         line = self.consume()
         return line.arg
 
     def parse_case(self):
         """Return a sequence of cases (single line of code each)."""
         # A case is a code fragment that assigns initial values
-        self.expect(LineToken.CODE)
+        self.expect(CODE)
         cases = []
         cases.append(self.consume())
         return cases
 
     def parse_query(self):
         """Parse a TEST line defining what outputs shall be tested."""
-        self.expect(LineToken.TEST)
+        self.expect(TEST)
         query = self.consume()
         return query.arg
 
     def parse_body(self):
         """Return a sequence of lines assumed to be a Python code fragment."""
-        body = []
-        while self.kind() == LineToken.CODE:
-            body.append(self.consume().text)
-        return body
+        return self.consume_code()
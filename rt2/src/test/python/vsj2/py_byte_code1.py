@@ -2,7 +2,7 @@
 
 import os
 from contextlib import closing
-from vsj2.exparser import LineToken, Lines
+from vsj2.exparser import EOF, Lines
 from vsj2.srcgen import PyObjectTestEmitter, PyObjectEmitter
 
 
@@ -24,14 +24,15 @@ def generate(test, writer=None):
 
 def main(examples):
     print("    // from {}\n".format(os.path.basename(examples)))
-    # Open the input and wrap in a parser
-    with closing(Lines(open(examples))) as lines:
-        # Anything before the first heading is not part of any test
-        lines.parse_preamble()
-        # Each test in the file produces a code object and one or more tests
-        while lines.kind() != LineToken.EOF:
-            test = lines.parse_test()
-            generate(test, PyObjectEmitter())
+    # Read the input into a parser (which consumes the whole file)
+    with open(examples) as f:
+        lines = Lines(f)
+    # Anything before the first heading is not part of any test
+    lines.parse_preamble()
+    # Each test in the file produces a code object and one or more tests
+    while lines.kind() != EOF:
+        test = lines.parse_test()
+        generate(test, PyObjectEmitter())
 
 
 if __name__ == "__main__":
@@ -1,8 +1,29 @@
 # Classes that emit indented, wrapped (Java) source code for tests
 
-import io
 import sys
 import dis
+import types
+import builtins
+from itertools import islice
+from functools import lru_cache
+
+
+# Translation table from characters to their escapes in a Java literal.
+# Control characters without a short form become 3-digit octal escapes.
+_JAVA_ESCAPES = {c: "\\{:03o}".format(c) for c in range(32)}
+_JAVA_ESCAPES.update({
+    ord('"'): '\\"', ord('\\'): '\\\\',
+    ord('\b'): '\\b', ord('\t'): '\\t', ord('\n'): '\\n',
+    ord('\f'): '\\f', ord('\r'): '\\r', 0x7f: '\\177'})
+
+
+@lru_cache(maxsize=4096)
+def java_literal(text):
+    """Return a Java String literal (in double quotes) for the text.
+
+    Names and string constants recur often, so results are cached.
+    """
+    return '"' + text.translate(_JAVA_ESCAPES) + '"'
 
 
 class IndentedEmitter:
@@ -14,8 +35,9 @@ class IndentedEmitter:
     sufficient buffer space, writing existing content to the output stream
     only as necessary to respect the stated width. The supplied text is
     treated as atomic, however long: neither method inserts line-breaks.
-    close() must be called to ensure the last buffered text reaches the
-    output stream. (Consider using contextlib.closing.)
+    Completed lines are written to the stream in large batches. close()
+    must be called to ensure the last buffered text reaches the output
+    stream. (Consider using contextlib.closing.)
     """
 
     class IndentationContextManager:
@@ -35,46 +57,94 @@ class IndentedEmitter:
         """Return a context manager to increase the indentation by one."""
         return JavaConstantEmitter.IndentationContextManager(self)
 
+    @property
+    def indent(self):
+        """The current indentation (number of four-space steps)."""
+        return self._indent
+
+    @indent.setter
+    def indent(self, n):
+        # Keep the string of spaces that begins each line up to date
+        self._indent = n
+        self._indent_str = "    " * n
+
+    def _indent_inc(self):
+        # Cheaper than "with self.indentation()" where called often
+        self._indent += 1
+        self._indent_str += "    "
+
+    def _indent_dec(self):
+        self._indent -= 1
+        self._indent_str = self._indent_str[:-4]
+
     def __init__(self, stream=None, width=None, indent=None):
         self.stream = stream or sys.stdout
         self.width = width if width is not None else 70
         self.indent = indent if indent is not None else 1
-        # Output buffer when lines are pieced together
-        self.buf = io.StringIO()
+        # Output buffer (list of str) when lines are pieced together
+        self.buf = []
+        # Length of the text in self.buf
+        self.col = 0
+        # Completed lines not yet written to the stream, and their size
+        self.pending = []
+        self.pending_size = 0
+
+    # Completed lines are written when this many characters are waiting
+    WRITE_SIZE = 65536
+
+    def _write_line(self, line):
+        """Add a completed line to those waiting to be written."""
+        self.pending.append(line)
+        self.pending_size += len(line) + 1
+        if self.pending_size >= self.WRITE_SIZE:
+            self._write_pending()
+
+    def _write_pending(self):
+        """Write all completed lines to the output stream in one call."""
+        if self.pending:
+            self.pending.append("")
+            self.stream.write("\n".join(self.pending))
+            self.pending = []
+            self.pending_size = 0
 
     def flush(self):
-        """Emit residual line (if any) to the output stream."""
-        residue = self.buf.getvalue().rstrip()
+        """Emit residual line (if any) and all others to the output stream."""
+        residue = "".join(self.buf).rstrip()
         if residue:
-            print(residue, file=self.stream)
-        self.buf.seek(0)
-        self.buf.truncate()
+            self._write_line(residue)
+        self._write_pending()
+        self.buf = []
+        self.col = 0
 
     close = flush  # synonym for the benefit of "with closing(...)"
 
     def emit(self, text="", suffix=""):
         """Write the text+suffix to self.buf, on a new line if necessary."""
-        n = len(text)
-        if suffix:
-            n += len(suffix)
-        if self.buf.tell() + n > self.width:
+        n = len(text) + len(suffix)
+        if self.col + n > self.width:
             # Must start a new line first
             self.emit_line()
-        self.buf.write(text)
+        if text:
+            self.buf.append(text)
         if suffix:
-            self.buf.write(suffix)
+            self.buf.append(suffix)
+        self.col += n
+        return self
+
+    def emit_lines(self, lines):
+        """Begin a new line for each of the given texts in turn."""
+        for text in lines:
+            self.emit_line(text)
         return self
 
     def emit_line(self, text=""):
         """Begin a new line with indent and optional text."""
-        if self.buf.tell() > 0:
-            # Flush existing buffer to output
-            print(self.buf.getvalue().rstrip(), file=self.stream)
-        self.buf.seek(0)
-        self.buf.truncate()
-        for i in range(self.indent):
-            self.buf.write("    ")
-        self.buf.write(text)
+        if self.col > 0:
+            # Complete the line in the existing buffer
+            self._write_line("".join(self.buf).rstrip())
+        indent = self._indent_str
+        self.buf = [indent, text]
+        self.col = len(indent) + len(text)
         return self
 
 
@@ -92,22 +162,20 @@ class JavaConstantEmitter(IndentedEmitter):
     def java_int(self, value, suffix=""):
         """Emit the value as a Java int constant."""
         if self.MIN_INT <= value <= self.MAX_INT:
-            return self.emit(repr(value) + suffix)
+            return self.emit(repr(value), suffix)
         else:
             raise ValueError("Value out of range for Java int")
 
     def java_string(self, value, suffix=""):
         """Emit the value as a Java String constant."""
-        text = repr(str(value))
-        if text.startswith("'"):
-            q = '"'
-            text = q + text[1:-1].replace(q, '\\"') + q
-        return self.emit(text, suffix)
+        return self.emit(java_literal(str(value)), suffix)
+
+    # Text of each (unsigned) byte value as a Java signed byte
+    BYTE_TEXT = tuple(str(v if v < 128 else v - 256) for v in range(256))
 
     def java_byte(self, value, suffix=""):
         """Emit the value as a Java int constant wrapped to signed byte."""
-        bstr = format(value if value < 128 else value - 256, "d")
-        return self.emit(bstr, suffix)
+        return self.emit(self.BYTE_TEXT[value], suffix)
 
     def java_double(self, value, suffix=""):
         """Emit the value as a Java double constant."""
@@ -119,10 +187,13 @@ class JavaConstantEmitter(IndentedEmitter):
         if n == 0:
             self.emit(suffix)
         else:
-            with self.indentation():
-                for i in range(n-1):
-                    handler(a[i], ", ")
+            self._indent_inc()
+            try:
+                for v in islice(a, n-1):
+                    handler(v, ", ")
                 handler(a[-1], suffix)
+            finally:
+                self._indent_dec()
         return self
 
     def java_array(self, handler, a, suffix=""):
@@ -132,13 +203,30 @@ class JavaConstantEmitter(IndentedEmitter):
             self.emit("{}", suffix)
         else:
             self.emit("{ ")
-            with self.indentation():
-                for i in range(n-1):
-                    handler(a[i], ", ")
+            self._indent_inc()
+            try:
+                for v in islice(a, n-1):
+                    handler(v, ", ")
                 handler(a[-1], " }" + suffix)
+            finally:
+                self._indent_dec()
         return self
 
 
+def _types_by_name():
+    # Types a python_<type> method may name, from builtins and types.
+    # Not every Python version exports these from types (NoneType).
+    found = {'NoneType': type(None), 'code': types.CodeType}
+    for module in (types, builtins):
+        for v in vars(module).values():
+            if isinstance(v, type):
+                found[v.__name__] = v
+    return found
+
+
+_TYPES_BY_NAME = _types_by_name()
+
+
 class PythonEmitter(JavaConstantEmitter):
     """An abstract class capable of emitting Python values as Java objects.
 
@@ -152,6 +240,19 @@ class PythonEmitter(JavaConstantEmitter):
         self._handlers = special_handlers or dict()
         super().__init__(**kwds)
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._make_method_table()
+
+    @classmethod
+    def _make_method_table(cls):
+        """Map each type having a python_<type> method to that method."""
+        cls._methods = {
+            _TYPES_BY_NAME[name[7:]]: getattr(cls, name)
+            for name in dir(cls)
+            if name.startswith("python_") and name[7:] in _TYPES_BY_NAME
+        }
+
     def add_special_handlers(self, handlers):
         """Map particular object values to f(obj, suffix)"""
         self._handlers.update(handlers)
@@ -162,14 +263,17 @@ class PythonEmitter(JavaConstantEmitter):
         if handler:
             handler(self, obj, suffix)
         else:
-            t = type(obj)
-            handler = getattr(self, "python_" + t.__name__, None)
-            if handler:
-                handler(obj, suffix)
+            method = self._methods.get(type(obj))
+            if method:
+                method(self, obj, suffix)
             else:
-                self.java_string(repr(t), suffix)
+                self.python_other(obj, suffix)
         return self
 
+    def python_other(self, value, suffix=""):
+        """Emit the type of a value no python_* method supports."""
+        return self.java_string(repr(type(value)), suffix)
+
     # Override the following at least
     def python_str(self, value, suffix=""): return self
     def python_int(self, value, suffix=""): return self
@@ -182,6 +286,9 @@ class PythonEmitter(JavaConstantEmitter):
     def python_code(self, code, suffix=""): return self
 
 
+PythonEmitter._make_method_table()
+
+
 class PyObjectEmitter(PythonEmitter):
     """A class capable of emitting Python values as PyObjects.
 
@@ -196,10 +303,7 @@ class PyObjectEmitter(PythonEmitter):
 
     def python_str(self, value, suffix=""):
         """Emit Java to construct a Python str."""
-        text = repr(value)
-        if text.startswith("'"):
-            q = '"'
-            text = q + text[1:-1].replace(q, '\\"') + q
+        text = java_literal(value)
         return self.emit(f"new PyUnicode({text})", suffix)
 
     def python_int(self, value, suffix=""):
@@ -226,27 +330,59 @@ class PyObjectEmitter(PythonEmitter):
     def python_bytes(self, value, suffix=""):
         """Emit Java to construct a Python bytes."""
         self.emit_line("new PyBytes(")
-        with self.indentation():
+        self._indent_inc()
+        try:
             self.emit("new byte[] ")
             self.java_array(self.java_byte, value, ")" + suffix)
+        finally:
+            self._indent_dec()
         return self
 
     def python_tuple(self, value, suffix=""):
         """Emit Java to construct a Python tuple."""
         self.emit_line("new PyTuple(")
-        with self.indentation():
+        self._indent_inc()
+        try:
             self.emit("new PyObject[] ")
             self.java_array(self.python, value, ")" + suffix)
+        finally:
+            self._indent_dec()
         return self
 
     def python_list(self, value, suffix=""):
         """Emit Java to construct a Python list."""
         self.emit_line("new PyList(")
-        with self.indentation():
+        self._indent_inc()
+        try:
             self.emit("new PyObject[] ")
             self.java_array(self.python, value, ")" + suffix)
+        finally:
+            self._indent_dec()
         return self
 
+    # Expression that begins construction of a code object
+    CODE_CONSTRUCTOR = "new PyCode("
+
+    # Emitter method and attribute for each constructor argument, in order
+    CODE_FIELDS = (
+        ("java_int", "co_argcount"),
+        ("java_int", "co_posonlyargcount"),
+        ("java_int", "co_kwonlyargcount"),
+        ("java_int", "co_nlocals"),
+        ("java_int", "co_stacksize"),
+        ("java_int", "co_flags"),
+        ("python", "co_code"),
+        ("python", "co_consts"),
+        ("python", "co_names"),
+        ("python", "co_varnames"),
+        ("python", "co_freevars"),
+        ("python", "co_cellvars"),
+        ("python", "co_filename"),
+        ("python", "co_name"),
+        ("java_int", "co_firstlineno"),
+        ("python", "co_lnotab"),
+    )
+
     def python_code(self, code, suffix=""):
         """Emit Java to construct a Python code object.
 
@@ -263,27 +399,31 @@ class PyObjectEmitter(PythonEmitter):
             self.emit_line(" */")
             self.emit_line("")
 
-        self.emit("new PyCode(")
-        with self.indentation():
-            self.java_int(code.co_argcount, ", ")
-            self.java_int(code.co_posonlyargcount, ", ")
-            self.java_int(code.co_kwonlyargcount, ", ")
-            self.java_int(code.co_nlocals, ", ")
-            self.java_int(code.co_stacksize, ", ")
-            self.java_int(code.co_flags, ", ")
-            self.python(code.co_code, ", ")
-            self.python(code.co_consts, ", ")
-            self.python(code.co_names, ", ")
-            self.python(code.co_varnames, ", ")
-            self.python(code.co_freevars, ", ")
-            self.python(code.co_cellvars, ", ")
-            self.python(code.co_filename, ", ")
-            self.python(code.co_name, ", ")
-            self.java_int(code.co_firstlineno, ", ")
-            self.python(code.co_lnotab, ")" + suffix)
+        self.emit(self.CODE_CONSTRUCTOR)
+        self._indent_inc()
+        try:
+            fields = self.CODE_FIELDS
+            for method, name in islice(fields, len(fields)-1):
+                getattr(self, method)(getattr(code, name), ", ")
+            method, name = fields[-1]
+            getattr(self, method)(getattr(code, name), ")" + suffix)
+        finally:
+            self._indent_dec()
         return self
 
 
+# Code objects compiled from test cases, keyed by source
+_compiled_cases = dict()
+
+
+def compile_case(source):
+    """Compile the source of a test case, once only for each source."""
+    code = _compiled_cases.get(source)
+    if code is None:
+        code = _compiled_cases[source] = compile(source, '<case>', 'exec')
+    return code
+
+
 class PyObjectTestEmitter:
     """Class to emit a test PyCode and a JUnit test method for each case.
 
@@ -294,10 +434,13 @@ class PyObjectTestEmitter:
     def __init__(self, test, writer=None):
         self.writer = PyObjectEmitter() if writer is None else writer
         self.test = test
-        # Compile the lines to byte code
+        # Compile the lines to byte code (disassembled by the writer)
         prog = '\n'.join(test.body)
-        code = compile(prog, self.test.name, 'exec')
-        self.bytecode = dis.Bytecode(code)
+        self.code = compile(prog, test.name, 'exec')
+        # The Java name of the code
+        self.code_name = test.name.upper()
+        # Results of running the cases: see run_case()
+        self.results = dict()
 
     def emit_line(self, text=""):
         """Begin a new line on the writer with indent and optional text."""
@@ -307,6 +450,28 @@ class PyObjectTestEmitter:
         """Flush and close this test emitter."""
         self.writer.close()
 
+    def run_case(self, c):
+        """Return the name spaces before and after the code for a case.
+
+        The results are kept, so a case with the same (compiled) code as
+        one already run in this test is not executed again.
+        """
+        results = self.results.get(c)
+        if results is None:
+            # Prepare the "before" name space by executing the "case" code
+            before = dict()
+            exec(c, {}, before)
+            # Execute the example code against a copy of that name space
+            globals = before.copy()
+            exec(self.code, globals)
+            # Extract those variables names as results to test
+            after = {k: globals[k] for k in self.test.test}
+            # Check
+            #print("before = {!r}".format(before))
+            #print("after = {!r}".format(after))
+            results = self.results[c] = before, after
+        return results
+
     def emit_test_material(self):
         """Emit the PyCode comments, declaration and initialiser."""
         self.emit_comments()
@@ -319,7 +484,8 @@ class PyObjectTestEmitter:
         for c in self.test.cases:
             num += 1
             name = "test_{}{:d}".format(self.test.name, num)
-            self.emit_test_method(name, c)
+            # The method receives the case compiled, ready to exec
+            self.emit_test_method(name, compile_case(c))
         return self
 
     def emit_comments(self):
@@ -335,24 +501,14 @@ class PyObjectTestEmitter:
         """Emit the PyCode declaration and initialiser"""
         self.writer.emit_line("//@formatter:off")
         self.writer.emit_line("static final PyCode ")
-        self.writer.emit(self.test.name.upper(), " = ")
-        self.writer.python_code(self.bytecode.codeobj, ";")
+        self.writer.emit(self.code_name, " = ")
+        self.writer.python_code(self.code, ";")
         self.writer.emit_line("//@formatter:on")
         return self.writer.emit_line()
 
     def emit_test_method(self, name, c):
-        """Emit one JUnit test method with the given name"""
-        # Prepare the "before" name space by executing the "case" code
-        before = dict()
-        exec(c, {}, before)
-        # Execute the example code against a copy of that name space
-        globals = dict(before)
-        exec(self.bytecode.codeobj, globals)
-        # Extract those variables names as results to test
-        after = {k: globals[k] for k in self.test.test}
-        # Check
-        #print("before = {!r}".format(before))
-        #print("after = {!r}".format(after))
+        """Emit one JUnit test method with the given name and case code"""
+        before, after = self.run_case(c)
         # Emit the code for the test method
         self.writer.emit_line("@Test")
         self.writer.emit_line("void " + name + "() {")
@@ -365,7 +521,7 @@ class PyObjectTestEmitter:
                 self.writer.python(k, ", ")
                 self.writer.python(v, ");")
             # Execute the code in the Java implementation
-            self.writer.emit_line("PyCode code = " + self.test.name.upper() + ";")
+            self.writer.emit_line("PyCode code = " + self.code_name + ";")
             self.writer.emit_line("ThreadState tstate = new ThreadState();")
             self.writer.emit_line(
                 "PyFrame frame = code.createFrame(tstate, globals, globals);")
@@ -393,10 +549,7 @@ class PyObjectEmitterEvo3(PyObjectEmitter):
     """
     def python_str(self, value, suffix=""):
         """Emit Java to construct a Python str."""
-        text = repr(value)
-        if text.startswith("'"):
-            q = '"'
-            text = q + text[1:-1].replace(q, '\\"') + q
+        text = java_literal(value)
         return self.emit(f"Py.str({text})", suffix)
 
     def python_int(self, value, suffix=""):
@@ -437,41 +590,8 @@ class PyObjectEmitterEvo3(PyObjectEmitter):
         self.java_arglist(self.python, value, ")" + suffix)
         return self
 
-    def python_code(self, code, suffix=""):
-        """Emit Java to construct a Python code object.
-
-        The assumed constructor exactly emulates CPython codeobject.c
-        PyCode_NewWithPosOnlyArgs, in turn assuming there are constructors
-        for Java implementations of the types depended upon.
-        """
-        if self.code_comment:
-            # Emit disassembly as comment
-            self.emit_line("/*")
-            lines = dis.Bytecode(code).dis().splitlines()
-            for line in lines:
-                self.emit_line(" * " + line)
-            self.emit_line(" */")
-            self.emit_line("")
-
-        self.emit("new CPythonCode(")
-        with self.indentation():
-            self.java_int(code.co_argcount, ", ")
-            self.java_int(code.co_posonlyargcount, ", ")
-            self.java_int(code.co_kwonlyargcount, ", ")
-            self.java_int(code.co_nlocals, ", ")
-            self.java_int(code.co_stacksize, ", ")
-            self.java_int(code.co_flags, ", ")
-            self.python(code.co_code, ", ")
-            self.python(code.co_consts, ", ")
-            self.python(code.co_names, ", ")
-            self.python(code.co_varnames, ", ")
-            self.python(code.co_freevars, ", ")
-            self.python(code.co_cellvars, ", ")
-            self.python(code.co_filename, ", ")
-            self.python(code.co_name, ", ")
-            self.java_int(code.co_firstlineno, ", ")
-            self.python(code.co_lnotab, ")" + suffix)
-        return self
+    # The code object of this evolution emulates CPython's closely
+    CODE_CONSTRUCTOR = "new CPythonCode("
 
 
 class PyObjectTestEmitterEvo3(PyObjectTestEmitter):
@@ -482,26 +602,12 @@ class PyObjectTestEmitterEvo3(PyObjectTestEmitter):
     """
 
     def __init__(self, test, writer=None):
-        self.writer = PyObjectEmitterEvo3() if writer is None else writer
-        self.test = test
-        # Compile the lines to byte code
-        prog = '\n'.join(test.body)
-        code = compile(prog, self.test.name, 'exec')
-        self.bytecode = dis.Bytecode(code)
+        super().__init__(test,
+                PyObjectEmitterEvo3() if writer is None else writer)
 
     def emit_test_method(self, name, c):
-        """Emit one JUnit test method with the given name"""
-        # Prepare the "before" name space by executing the "case" code
-        before = dict()
-        exec(c, {}, before)
-        # Execute the example code against a copy of that name space
-        globals = dict(before)
-        exec(self.bytecode.codeobj, globals)
-        # Extract those variables names as results to test
-        after = {k: globals[k] for k in self.test.test}
-        # Check
-        #print("before = {!r}".format(before))
-        #print("after = {!r}".format(after))
+        """Emit one JUnit test method with the given name and case code"""
+        before, after = self.run_case(c)
         # Emit the code for the test method
         self.writer.emit_line("@Test")
         self.writer.emit_line("void " + name + "() {")
@@ -517,7 +623,7 @@ class PyObjectTestEmitterEvo3(PyObjectTestEmitter):
             # Execute the code in the Java implementation
             self.writer.emit_line("Interpreter interp = Py.createInterpreter();")
             self.writer.emit_line("interp.evalCode(")
-            self.writer.emit(self.test.name.upper())
+            self.writer.emit(self.code_name)
             self.writer.emit(", globals, globals);")
             # Compare named results against the values this Python got
             for k, v in after.items():
@@ -588,31 +694,17 @@ class PyObjectTestEmitterEvo4(PyObjectTestEmitter):
     """
 
     def __init__(self, test, writer=None):
-        self.writer = PyObjectEmitterEvo3() if writer is None else writer
-        self.test = test
-        # Compile the lines to byte code
-        prog = '\n'.join(test.body)
-        code = compile(prog, self.test.name, 'exec')
-        self.bytecode = dis.Bytecode(code)
+        super().__init__(test,
+                PyObjectEmitterEvo3() if writer is None else writer)
         # Handle built-ins distinctly
-        writer.add_special_handlers(PyObjectTestEmitterEvo4.snitliub)
+        self.writer.add_special_handlers(PyObjectTestEmitterEvo4.snitliub)
 
     # Lookup from ids of builtins values to an access expression
     snitliub = _make_handlers()
 
     def emit_test_method(self, name, c):
-        """Emit one JUnit test method with the given name"""
-        # Prepare the "before" name space by executing the "case" code
-        before = dict()
-        exec(c, {}, before)
-        # Execute the example code against a copy of that name space
-        globals = dict(before)
-        exec(self.bytecode.codeobj, globals)
-        # Extract those variables names as results to test
-        after = {k: globals[k] for k in self.test.test}
-        # Check
-        #print("before = {!r}".format(before))
-        #print("after = {!r}".format(after))
+        """Emit one JUnit test method with the given name and case code"""
+        before, after = self.run_case(c)
         # Emit the code for the test method
         self.writer.emit_line("@Test")
         self.writer.emit_line("void " + name + "() {")
@@ -630,7 +722,7 @@ class PyObjectTestEmitterEvo4(PyObjectTestEmitter):
                     self.writer.python(v, ");")
             # Execute the code in the Java implementation
             self.writer.emit_line("interp.evalCode(")
-            self.writer.emit(self.test.name.upper())
+            self.writer.emit(self.code_name)
             self.writer.emit(", globals, globals);")
             # Compare named results against the values this Python got
             for k, v in after.items():
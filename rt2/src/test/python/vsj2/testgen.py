@@ -1,13 +1,18 @@
 # Generate examples for the bytecode interpreter - evo3
 
+import io
 import os
 import re
+import sys
 from contextlib import closing
-from vsj2.exparser import LineToken, Lines
+from vsj2.exparser import EOF, Lines
 from vsj2.srcgen import PyObjectTestEmitter, PyObjectEmitter, \
     PyObjectEmitterEvo3, PyObjectTestEmitterEvo3, PyObjectTestEmitterEvo4, \
     PyObjectEmitterEvo4
 
+# Name of the file from which main() is called, e.g. py_byte_code3_evo4.py
+TEST_FILE_PATTERN = re.compile(r"(py_byte_code\d+)_evo(\d+)\.py")
+
 
 def generate(test, testType=None, writer=None):
     """Generate Java code to test one program example"""
@@ -23,36 +28,48 @@ def generate(test, testType=None, writer=None):
 def main(filename):
     # Derive the examples file name from one passed in
     dirname, basename = os.path.split(filename)
-    m = re.search(r"(py_byte_code\d+)_evo(\d+)\.py", basename)
+    m = TEST_FILE_PATTERN.search(basename)
+    if m is None:
+        raise ValueError("{} is not a test file name".format(basename))
     name = "{}.ex.py".format(m.group(1))
     evo = int(m.group(2))
+
+    # Collect all the output, to write to stdout in one go at the end
+    out = io.StringIO()
     print("    // Code generated by {}\n    // from {}\n"
-          .format(basename, name))
+          .format(basename, name), file=out)
 
     # Choose the writer evo
     if evo <= 2:
-        writer = PyObjectEmitter(code_comment=True)
+        writer = PyObjectEmitter(stream=out, code_comment=True)
         testType = PyObjectTestEmitter
     elif evo == 3:
-        writer = PyObjectEmitterEvo3(code_comment=True)
+        writer = PyObjectEmitterEvo3(stream=out, code_comment=True)
         testType = PyObjectTestEmitterEvo3
     elif evo == 4:
-        writer = PyObjectEmitterEvo4(code_comment=True)
+        writer = PyObjectEmitterEvo4(stream=out, code_comment=True)
         testType = PyObjectTestEmitterEvo4
     else:
         raise ValueError("evo = {} out of range".format(evo))
 
-    # Open the input and wrap in a parser
+    # Read the input into a parser (which consumes the whole file)
     examples = os.path.join(dirname, name)
-    with closing(Lines(open(examples))) as lines:
-        # Anything before the first heading is not part of any test
-        lines.parse_preamble()
-        # Each test in the file produces a code object and one or more tests
-        while lines.kind() != LineToken.EOF:
-            test = lines.parse_test()
-            # Strip blank lines from end of example
-            body = test.body
-            while len(body[-1]) == 0:
-                body.pop(-1)
-            # Emit the text of the test
-            generate(test, testType, writer)
+    with open(examples) as f:
+        lines = Lines(f)
+
+    # Anything before the first heading is not part of any test
+    lines.parse_preamble()
+    # Each test in the file produces a code object and one or more tests
+    while lines.kind() != EOF:
+        test = lines.parse_test()
+        # Strip blank lines from end of example
+        body = test.body
+        n = len(body)
+        while n > 0 and not body[n-1]:
+            n -= 1
+        if n < len(body):
+            test.body = body[:n]
+        # Emit the text of the test
+        generate(test, testType, writer)
+
+    sys.stdout.write(out.getvalue())
@@ -58,6 +58,10 @@ class OpInfo:
     min_working_type: WorkingType
 
 
+# Time stamp written into every file generated in this run
+_RUN_TIMESTAMP = datetime.now().strftime("%A %Y-%m-%d %H:%M:%S")
+
+
 # Base class of generators for object implementations
 
 class ImplementationGenerator:
@@ -73,8 +77,7 @@ class ImplementationGenerator:
         e.emit_line(" * Generated by java_object_gen using ")
         e.emit(f"generator {self.__class__.__name__}.")
         e.emit_line(f" * Source: {name}")
-        timestamp = datetime.now().strftime("%A %Y-%m-%d %H:%M:%S")
-        e.emit_line(f" * Date: {timestamp}")
+        e.emit_line(f" * Date: {_RUN_TIMESTAMP}")
         e.emit_line(" */")
 
     # Emit a rule (comment) above a block of implementations